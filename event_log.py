@@ -54,6 +54,16 @@ class EventLog(object):
     """Initializes the event log."""
     self._log = []
     self._parent = None
+    self._enabled = True
+
+  def Disable(self):
+    """Stop recording new events.
+
+    Used when the log isn't going to be written out, so that commands don't
+    spend time gathering event details (e.g. resolving a project's current
+    commit for every sync event) that nobody will see.
+    """
+    self._enabled = False
 
   def Add(self, name, task_name, start, finish=None, success=None,
           try_count=1, kind='RepoOp'):
@@ -69,8 +79,12 @@ class EventLog(object):
       kind: The kind of the object for the unique identifier.
 
     Returns:
-      A dictionary of the event added to the log.
+      A dictionary of the event added to the log, or None if the log has been
+      disabled.
     """
+    if not self._enabled:
+      return None
+
     event = {
         'id': (kind, _NextEventId()),
         'name': name,
@@ -100,7 +114,8 @@ class EventLog(object):
       success: Boolean indicating if the operation was successful.
 
     Returns:
-      A dictionary of the event added to the log.
+      A dictionary of the event added to the log, or None if the log has been
+      disabled.
     """
     event = self.Add(project.relpath, task_name, start, finish, success)
     if event is not None:
@@ -132,13 +147,16 @@ class EventLog(object):
     """Finishes an incomplete event.
 
     Args:
-      event: An event that has been added to the log.
+      event: An event that has been added to the log, or None if the log was
+          disabled when the event was added.
       finish: Timestamp of when the operation finished.
       success: Boolean indicating if the operation was successful.
 
     Returns:
       A dictionary of the event added to the log.
     """
+    if event is None:
+      return None
     event['status'] = self.GetStatusString(success)
     event['finish_time'] = finish
     return event
@@ -15,6 +15,7 @@
 # limitations under the License.
 
 from __future__ import print_function
+import collections
 import os
 import re
 import sys
@@ -42,6 +43,13 @@ MIN_GIT_VERSION_SOFT = (1, 9, 1)
 MIN_GIT_VERSION_HARD = (1, 7, 2)
 GIT_DIR = 'GIT_DIR'
 
+# How many chunks of output to remember for streams we're already showing to
+# the user.  Reads are at most a few KiB, so this keeps the tail bounded.
+_TEE_TAIL_CHUNKS = 64
+
+# How much partial line output to hold back before passing it through anyway.
+_TEE_FLUSH_SIZE = 4096
+
 LAST_GITDIR = None
 LAST_CWD = None
 
@@ -249,6 +257,20 @@ def git_require(min_version, fail=False, msg=''):
 
 
 class GitCommand(object):
+  """A git subprocess.
+
+  Once Wait() returns, the stdout and stderr attributes hold the command's
+  output as strings.  Captured streams are kept in full.  Streams that are
+  passed through to the user instead only keep their tail (the last
+  _TEE_TAIL_CHUNKS reads), which is enough to look for error messages, but
+  isn't necessarily everything git printed.
+
+  With line_buffered, passed through output is held back until a whole line
+  (or git progress update) is available.  That's only meant for commands like
+  fetch whose output is all complete lines: anything else (e.g. a prompt) would
+  stay hidden until the line is finished.
+  """
+
   def __init__(self,
                project,
                cmdv,
@@ -260,11 +282,13 @@ class GitCommand(object):
                disable_editor=False,
                ssh_proxy=False,
                cwd=None,
-               gitdir=None):
+               gitdir=None,
+               line_buffered=False):
     env = self._GetBasicEnv()
 
     # If we are not capturing std* then need to print it.
     self.tee = {'stdout': not capture_stdout, 'stderr': not capture_stderr}
+    self.line_buffered = line_buffered
 
     if disable_editor:
       env['GIT_EDITOR'] = ':'
@@ -387,23 +411,42 @@ class GitCommand(object):
     s_in.add(p.stdout, sys.stdout, 'stdout')
     if p.stderr is not None:
       s_in.add(p.stderr, sys.stderr, 'stderr')
-    self.stdout = ''
-    self.stderr = ''
+    # Output is collected in chunks and joined once the command is done, rather
+    # than repeatedly concatenating (and copying) ever longer strings.
+    # Output that we're passing through to the user is only kept around for
+    # its tail (e.g. so callers can look for error messages).  That way noisy
+    # commands like a large fetch don't accumulate everything in memory.
+    chunks = dict(
+        (name, collections.deque(maxlen=_TEE_TAIL_CHUNKS) if tee else [])
+        for name, tee in self.tee.items())
+    # When line buffered, output is passed through a line at a time (git
+    # progress lines end in a \r) so we make fewer writes, and parallel
+    # commands don't garble each other's output.
+    pending = dict((name, '') for name, tee in self.tee.items() if tee)
 
     while not s_in.is_done:
       in_ready = s_in.select()
       for s in in_ready:
         buf = s.read()
         if not buf:
+          if pending.get(s.std_name):
+            s.dest.write(pending[s.std_name])
+            s.dest.flush()
           s_in.remove(s)
           continue
         if not hasattr(buf, 'encode'):
           buf = buf.decode()
-        if s.std_name == 'stdout':
-          self.stdout += buf
-        else:
-          self.stderr += buf
+        chunks[s.std_name].append(buf)
         if self.tee[s.std_name]:
-          s.dest.write(buf)
-          s.dest.flush()
+          data = pending[s.std_name] + buf
+          if not self.line_buffered or len(data) >= _TEE_FLUSH_SIZE:
+            end = len(data)
+          else:
+            end = max(data.rfind('\n'), data.rfind('\r')) + 1
+          if end:
+            s.dest.write(data[:end])
+            s.dest.flush()
+          pending[s.std_name] = data[end:]
+    for name, chunk_list in chunks.items():
+      setattr(self, name, ''.join(chunk_list))
     return p.wait()
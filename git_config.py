@@ -328,8 +328,10 @@ class GitConfig(object):
 
   def _SaveJson(self, cache):
     try:
+      # This is a machine-only cache that's rewritten whenever the config
+      # changes, so skip the indentation and serialize it in a single pass.
       with open(self._json, 'w') as fd:
-        json.dump(cache, fd, indent=2)
+        fd.write(json.dumps(cache))
     except (IOError, TypeError):
       if os.path.exists(self._json):
         platform_utils.remove(self._json)
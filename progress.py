@@ -59,7 +59,7 @@ class Progress(object):
           self._done))
       sys.stderr.flush()
     else:
-      p = (100 * self._done) / self._total
+      p = (100 * self._done) // self._total
 
       if self._lastp != p or self._always_print_percentage:
         self._lastp = p
@@ -84,7 +84,7 @@ class Progress(object):
           self._done))
       sys.stderr.flush()
     else:
-      p = (100 * self._done) / self._total
+      p = (100 * self._done) // self._total
       sys.stderr.write('%s\r%s: %3d%% (%d%s/%d%s), done.\n' % (
           CSI_ERASE_LINE,
           self._title,
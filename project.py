@@ -504,8 +504,9 @@ class Project(object):
       is_derived: False if the project was explicitly defined in the manifest;
                   True if the project is a discovered submodule.
       dest_branch: The branch to which to push changes for review by default.
-      optimized_fetch: If True, when a project is set to a sha1 revision, only
-                       fetch from the remote if the sha1 is not present locally.
+      optimized_fetch: If True, when a project is set to a sha1 or tag
+                       revision, only fetch from the remote if the revision is
+                       not present locally.
       retry_fetches: Retry remote fetches n times upon receiving transient error
                      with exponential backoff and jitter.
       old_revision: saved git commit id for open GITC projects.
@@ -1132,9 +1133,12 @@ class Project(object):
     else:
       depth = self.manifest.manifestProject.config.GetString('repo.depth')
 
-    # See if we can skip the network fetch entirely.
+    # See if we can skip the network fetch entirely.  Like sha1s, tags are
+    # treated as immutable (see _RemoteFetch), so a pinned tag we already have
+    # doesn't need refetching either.
     if not (optimized_fetch and
-            (ID_RE.match(self.revisionExpr) and
+            ((ID_RE.match(self.revisionExpr) or
+              self.revisionExpr.startswith(R_TAGS)) and
              self._CheckForImmutableRevision())):
       if not self._RemoteFetch(
               initial=is_new, quiet=quiet, verbose=verbose, alt_dir=alt_dir,
@@ -2135,7 +2139,8 @@ class Project(object):
     ok = prune_tried = False
     for try_n in range(retry_fetches):
       gitcmd = GitCommand(self, cmd, bare=True, ssh_proxy=ssh_proxy,
-                          merge_output=True, capture_stdout=quiet)
+                          merge_output=True, capture_stdout=quiet,
+                          line_buffered=True)
       ret = gitcmd.Wait()
       if ret == 0:
         ok = True
@@ -57,7 +57,7 @@ setuptools.setup(
         'Operating System :: POSIX :: Linux',
         'Topic :: Software Development :: Version Control :: Git',
     ],
-    # We support Python 2.7 and Python 3.6+.
-    python_requires='>=2.7, ' + ', '.join('!=3.%i.*' % x for x in range(0, 6)),
+    # We support Python 3.6+.  Python 2 users need the legacy repo-1.x branch.
+    python_requires='>=3.6',
     packages=['subcmds'],
 )
@@ -16,36 +16,20 @@
 
 from __future__ import print_function
 
+from collections import defaultdict
+import concurrent.futures
+import itertools
 import json
 import netrc
 from optparse import SUPPRESS_HELP
 import os
+import queue
 import re
 import socket
 import subprocess
 import sys
-import tempfile
 import time
-
-from pyversion import is_python3
-if is_python3():
-  import http.cookiejar as cookielib
-  import urllib.error
-  import urllib.parse
-  import urllib.request
-  import xmlrpc.client
-else:
-  import cookielib
-  import imp
-  import urllib2
-  import urlparse
-  import xmlrpclib
-  urllib = imp.new_module('urllib')
-  urllib.error = urllib2
-  urllib.parse = urlparse
-  urllib.request = urllib2
-  xmlrpc = imp.new_module('xmlrpc')
-  xmlrpc.client = xmlrpclib
+import urllib.parse
 
 try:
   import threading as _threading
@@ -61,14 +45,8 @@ except ImportError:
   def _rlimit_nofile():
     return (256, 256)
 
-try:
-  import multiprocessing
-except ImportError:
-  multiprocessing = None
-
 import event_log
 from git_command import GIT, git_require
-from git_config import GetUrlCookieFile
 from git_refs import R_HEADS, HEAD
 import gitc_utils
 from project import Project
@@ -83,10 +61,49 @@ from manifest_xml import GitcManifest
 
 _ONE_DAY_S = 24 * 60 * 60
 
+# `git describe` output for a commit that is not exactly on a tag.
+_UNTAGGED_DESCRIBE_RE = re.compile(r'^.*-[0-9]{1,}-g[0-9a-f]{1,}$')
+
+# Upper bound on the number of objdir groups handed to a fetch worker at once.
+_WORKER_BATCH_SIZE = 32
+
+# Checkouts can take much longer per project than fetches, so keep their
+# batches small to avoid one worker ending up with all the slow ones.
+_CHECKOUT_BATCH_SIZE = 4
+
+
+def _cpu_count():
+  """Return the number of CPUs this process is allowed to run on.
 
-class _FetchError(Exception):
-  """Internal error thrown in _FetchHelper() when we don't want stack trace."""
-  pass
+  Unlike os.cpu_count(), this honors the CPU affinity mask (e.g. taskset or a
+  container's cpuset), so we don't oversubscribe restricted machines.
+  """
+  if hasattr(os, 'sched_getaffinity'):
+    return len(os.sched_getaffinity(0))
+  return os.cpu_count() or 1
+
+
+def _default_jobs():
+  """Return how many projects to fetch at once without -j or sync-j.
+
+  Fetches spend most of their time waiting on the network rather than the CPU,
+  so run several at once even on small machines.
+  """
+  return max(8, _cpu_count())
+
+
+def _chunksize(projects, jobs, limit=_WORKER_BATCH_SIZE):
+  """Calculate how many work units to batch together for each worker.
+
+  We aim for a handful of batches per job so the workers stay balanced, while
+  still amortizing the per-task overhead when projects vastly outnumber jobs.
+
+  Args:
+    projects: The number of work units.
+    jobs: The number of workers.
+    limit: The largest batch to hand out.
+  """
+  return min(max(1, projects // (jobs * 4)), limit)
 
 
 class _CheckoutError(Exception):
@@ -95,6 +112,7 @@ class _CheckoutError(Exception):
 
 class Sync(Command, MirrorSafeCommand):
   jobs = 1
+  local_jobs = 1
   common = True
   helpSummary = "Update working tree to the latest revision"
   helpUsage = """
@@ -162,9 +180,9 @@ of a project from server.
 The -c/--current-branch option can be used to only fetch objects that
 are on the branch specified by a project's revision.
 
-The --optimized-fetch option can be used to only fetch projects that
-are fixed to a sha1 revision if the sha1 revision does not already
-exist locally.
+By default, projects that are fixed to a sha1 revision or a tag are only
+fetched if that revision does not already exist locally.  The
+--no-optimized-fetch option can be used to always contact the remote.
 
 The --prune option can be used to remove any refs that no longer
 exist on the remote.
@@ -199,9 +217,9 @@ later is required to fix a server side protocol bug.
 
   def _Options(self, p, show_smart=True):
     try:
-      self.jobs = self.manifest.default.sync_j
+      self.jobs = self.manifest.default.sync_j or _default_jobs()
     except ManifestParseError:
-      self.jobs = 1
+      self.jobs = _default_jobs()
 
     p.add_option('-f', '--force-broken',
                  dest='force_broken', action='store_true',
@@ -264,8 +282,13 @@ later is required to fix a server side protocol bug.
                  dest='tags', default=True, action='store_false',
                  help="don't fetch tags")
     p.add_option('--optimized-fetch',
-                 dest='optimized_fetch', action='store_true',
-                 help='only fetch projects fixed to sha1 if revision does not exist locally')
+                 dest='optimized_fetch', action='store_true', default=True,
+                 help='only fetch projects fixed to sha1 or tag if revision '
+                      'does not exist locally (default)')
+    p.add_option('--no-optimized-fetch',
+                 dest='optimized_fetch', action='store_false',
+                 help='always fetch projects fixed to sha1 or tag from the '
+                      'remote')
     p.add_option('--retry-fetches',
                  default=0, action='store', type='int',
                  help='number of times to retry fetches on transient errors')
@@ -287,54 +310,79 @@ later is required to fix a server side protocol bug.
                  dest='repo_upgraded', action='store_true',
                  help=SUPPRESS_HELP)
 
-  def _FetchProjectList(self, opt, projects, sem, *args, **kwargs):
-    """Main function of the fetch threads.
+  def _SetJobs(self, opt):
+    """Work out how many jobs to run for each part of the sync.
+
+    -j (or the manifest's sync-j) applies to everything.  Without either,
+    fetches default to several jobs as they're mostly waiting on the network,
+    while checkouts and git gc keep running one at a time.
+    """
+    jobs = opt.jobs or self.manifest.default.sync_j
+    if jobs:
+      self.jobs = self.local_jobs = jobs
+    else:
+      self.jobs = _default_jobs()
+      self.local_jobs = 1
+    # Don't run more jobs than we have file descriptors for.
+    soft_limit, _ = _rlimit_nofile()
+    max_jobs = max(1, (soft_limit - 5) // 3)
+    self.jobs = min(self.jobs, max_jobs)
+    self.local_jobs = min(self.local_jobs, max_jobs)
+
+  def _FetchProjectList(self, opt, projects, err_event, stop_event, report,
+                        **kwargs):
+    """Main function of the fetch worker threads.
 
     Delegates most of the work to _FetchHelper.
 
     Args:
       opt: Program options returned from optparse.  See _Options().
       projects: Projects to fetch.
-      sem: We'll release() this semaphore when we exit so that another thread
-          can be started up.
-      *args, **kwargs: Remaining arguments to pass to _FetchHelper. See the
+      err_event: We'll stop fetching once this event is set if --fail-fast
+          was given.
+      stop_event: We'll stop fetching once this event is set (e.g. Ctrl-C).
+      report: Called with (project, success) as soon as each project has been
+          fetched.  The caller takes care of recording the result and
+          reporting failures.
+      **kwargs: Remaining arguments to pass to _FetchHelper. See the
           _FetchHelper docstring for details.
     """
-    try:
-        for project in projects:
-          success = self._FetchHelper(opt, project, *args, **kwargs)
-          if not success and opt.fail_fast:
-            break
-    finally:
-        sem.release()
+    for project in projects:
+      # Check for any errors before running any more tasks.
+      # ...we'll let existing fetches finish, though.
+      if stop_event.isSet() or (err_event.isSet() and opt.fail_fast):
+        break
+      try:
+        success = self._FetchHelper(opt, project, err_event=err_event,
+                                    **kwargs)
+      except Exception:
+        # _FetchHelper has already reported this and set err_event.  Don't let
+        # one broken project take the rest of the batch down with it.
+        continue
+      report(project, success)
+      if not success and opt.fail_fast:
+        break
 
-  def _FetchHelper(self, opt, project, lock, fetched, pm, err_event,
-                   clone_filter):
+  def _FetchHelper(self, opt, project, err_event, archive, clone_filter):
     """Fetch git objects for a single project.
 
     Args:
       opt: Program options returned from optparse.  See _Options().
       project: Project object for the project to fetch.
-      lock: Lock for accessing objects that are shared amongst multiple
-          _FetchHelper() threads.
-      fetched: set object that we will add project.gitdir to when we're done
-          (with our lock held).
-      pm: Instance of a Project object.  We will call pm.update() (with our
-          lock held).
-      err_event: We'll set this event in the case of an error (after printing
-          out info about the error).
+      err_event: We'll set this event in the case of an error.  The caller
+          reports failed fetches.
+      archive: Whether the manifest is an archive checkout.
       clone_filter: Filter for use in a partial clone.
 
     Returns:
       Whether the fetch was successful.
     """
-    # We'll set to true once we've locked the lock.
-    did_lock = False
-
-    # Encapsulate everything in a try/except/finally so that:
-    # - We always set err_event in the case of an exception.
-    # - We always make sure we unlock the lock if we locked it.
+    # Encapsulate everything in a try/except/finally so that we always set
+    # err_event in the case of an exception.
+    # The event log wants wall clock timestamps, but the fetch duration is
+    # measured with the monotonic clock so it can't go backwards.
     start = time.time()
+    start_monotonic = time.monotonic()
     success = False
     try:
       try:
@@ -344,38 +392,21 @@ later is required to fix a server side protocol bug.
             current_branch_only=opt.current_branch_only,
             force_sync=opt.force_sync,
             clone_bundle=opt.clone_bundle,
-            tags=opt.tags, archive=self.manifest.IsArchive,
+            tags=opt.tags, archive=archive,
             optimized_fetch=opt.optimized_fetch,
             retry_fetches=opt.retry_fetches,
             prune=opt.prune,
             clone_filter=clone_filter)
-        self._fetch_times.Set(project, time.time() - start)
-
-        # Lock around all the rest of the code, since printing, updating a set
-        # and Progress.update() are not thread safe.
-        lock.acquire()
-        did_lock = True
+        self._fetch_times.Set(project, time.monotonic() - start_monotonic)
 
         if not success:
           err_event.set()
-          print('error: Cannot fetch %s from %s'
-                % (project.name, project.remote.url),
-                file=sys.stderr)
-          if opt.fail_fast:
-            raise _FetchError()
-
-        fetched.add(project.gitdir)
-        pm.update(msg=project.name)
-      except _FetchError:
-        pass
       except Exception as e:
         print('error: Cannot fetch %s (%s: %s)'
               % (project.name, type(e).__name__, str(e)), file=sys.stderr)
         err_event.set()
         raise
     finally:
-      if did_lock:
-        lock.release()
       finish = time.time()
       self.event_log.AddSync(project, event_log.TASK_SYNC_NETWORK,
                              start, finish, success)
@@ -384,43 +415,113 @@ later is required to fix a server side protocol bug.
 
   def _Fetch(self, projects, opt, err_event):
     fetched = set()
-    lock = _threading.Lock()
     pm = Progress('Fetching projects', len(projects),
                   always_print_percentage=opt.quiet)
 
-    objdir_project_map = dict()
+    objdir_project_map = defaultdict(list)
     for project in projects:
-      objdir_project_map.setdefault(project.objdir, []).append(project)
-
-    threads = set()
-    sem = _threading.Semaphore(self.jobs)
-    for project_list in objdir_project_map.values():
-      # Check for any errors before running any more tasks.
-      # ...we'll let existing threads finish, though.
-      if err_event.isSet() and opt.fail_fast:
-        break
+      objdir_project_map[project.objdir].append(project)
+
+    # Projects sharing an object directory have to be fetched serially, so
+    # each work item is a batch of whole objdir groups.  Batching keeps the
+    # number of tasks down on large manifests.
+    # Start the groups we expect to take longest first, and deal them out
+    # across the batches so the slow ones don't all end up in the same batch.
+    project_lists = sorted(
+        objdir_project_map.values(),
+        key=lambda x: sum(self._fetch_times.Get(p) for p in x),
+        reverse=True)
+    if self.jobs > 1:
+      chunksize = _chunksize(len(project_lists), self.jobs)
+    else:
+      # There's no task overhead to save when fetching serially, so handle
+      # each group on its own to keep progress and errors next to the fetch.
+      chunksize = 1
+    num_batches = (len(project_lists) + chunksize - 1) // chunksize
+    work_items = [
+        list(itertools.chain.from_iterable(project_lists[i::num_batches]))
+        for i in range(num_batches)]
+
+    def _ProcessResult(project, success):
+      # Only the main thread reports results, so the messages can't be
+      # interleaved with each other or with the progress meter.
+      if not success:
+        print('error: Cannot fetch %s from %s'
+              % (project.name, project.remote.url),
+              file=sys.stderr)
+        if opt.fail_fast:
+          return
+      fetched.add(project.gitdir)
+      pm.update(msg=project.name)
 
-      sem.acquire()
-      kwargs = dict(opt=opt,
-                    projects=project_list,
-                    sem=sem,
-                    lock=lock,
-                    fetched=fetched,
-                    pm=pm,
-                    err_event=err_event,
-                    clone_filter=self.manifest.CloneFilter)
-      if self.jobs > 1:
-        t = _threading.Thread(target=self._FetchProjectList,
-                              kwargs=kwargs)
-        # Ensure that Ctrl-C will not freeze the repo process.
-        t.daemon = True
-        threads.add(t)
-        t.start()
-      else:
-        self._FetchProjectList(**kwargs)
+    def _ProcessBatch(future):
+      if future.cancelled():
+        return
+      try:
+        future.result()
+      except Exception as e:
+        # Projects report their own errors, so this is a bug in the worker
+        # itself.  Treat it like a failed fetch rather than abandoning all the
+        # other batches.
+        print('error: fetch worker failed: %s: %s'
+              % (type(e).__name__, str(e)), file=sys.stderr)
+        err_event.set()
 
-    for t in threads:
-      t.join()
+    # Set when we're bailing out (e.g. Ctrl-C) so running workers don't start
+    # on the rest of their batch.
+    stop_event = _threading.Event()
+    # These are backed by manifest config lookups and can't change during the
+    # fetch, so resolve them once rather than once per project.
+    kwargs = dict(opt=opt,
+                  err_event=err_event,
+                  stop_event=stop_event,
+                  archive=self.manifest.IsArchive,
+                  clone_filter=self.manifest.CloneFilter)
+    # With only one batch there's nothing to run in parallel, so don't bother
+    # starting up a pool (e.g. when re-fetching a few missing projects).
+    if self.jobs > 1 and len(work_items) > 1:
+      # The fetches are dominated by waiting on git subprocesses, so threads
+      # give us all the parallelism we need without any worker start up costs.
+      # Workers hand each project's result back as soon as it's fetched, so
+      # failures are reported right away rather than when the batch is done.
+      # Finished (or cancelled) batches are queued up behind their results.
+      results = queue.Queue()
+      executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs)
+      with executor:
+        futures = [executor.submit(self._FetchProjectList,
+                                   projects=work_item,
+                                   report=lambda *result: results.put(result),
+                                   **kwargs)
+                   for work_item in work_items]
+        for future in futures:
+          future.add_done_callback(results.put)
+        try:
+          remaining = len(futures)
+          while remaining:
+            result = results.get()
+            if isinstance(result, concurrent.futures.Future):
+              _ProcessBatch(result)
+              remaining -= 1
+            else:
+              _ProcessResult(*result)
+            # With --fail-fast, drop the batches that haven't started yet as
+            # soon as we see a failure rather than have each of them start up
+            # only to notice the error and stop.
+            if opt.fail_fast and err_event.isSet():
+              for f in futures:
+                f.cancel()
+        except BaseException:
+          # Ensure that Ctrl-C will not leave queued fetches running.  The
+          # in-flight git processes get the SIGINT too, and the workers stop
+          # once those exit, so we only wait for them to wind down.
+          stop_event.set()
+          for future in futures:
+            future.cancel()
+          raise
+    else:
+      for work_item in work_items:
+        self._FetchProjectList(projects=work_item, report=_ProcessResult,
+                               **kwargs)
 
     pm.end()
     self._fetch_times.Save()
@@ -430,23 +531,36 @@ later is required to fix a server side protocol bug.
 
     return fetched
 
-  def _CheckoutWorker(self, opt, sem, project, *args, **kwargs):
-    """Main function of the fetch threads.
+  def _CheckoutProjectList(self, opt, projects, err_event, **kwargs):
+    """Main function of the checkout worker threads.
 
     Delegates most of the work to _CheckoutOne.
 
     Args:
       opt: Program options returned from optparse.  See _Options().
-      projects: Projects to fetch.
-      sem: We'll release() this semaphore when we exit so that another thread
-          can be started up.
-      *args, **kwargs: Remaining arguments to pass to _CheckoutOne. See the
+      projects: Projects to checkout.
+      err_event: We'll stop checking out once this event is set if
+          --fail-fast was given.
+      **kwargs: Remaining arguments to pass to _CheckoutOne. See the
           _CheckoutOne docstring for details.
+
+    Returns:
+      The list of projects whose checkout raised an exception.
     """
-    try:
-      return self._CheckoutOne(opt, project, *args, **kwargs)
-    finally:
-      sem.release()
+    broken = []
+    for project in projects:
+      # Check for any errors before running any more tasks.
+      # ...we'll let existing checkouts finish, though.
+      if err_event.isSet() and opt.fail_fast:
+        break
+      try:
+        self._CheckoutOne(opt, project, err_event=err_event, **kwargs)
+      except Exception:
+        # _CheckoutOne has already reported and recorded the failure.  Carry
+        # on with the rest of the batch, and let the caller skip anything
+        # nested under this project's (possibly broken) work tree.
+        broken.append(project)
+    return broken
 
   def _CheckoutOne(self, opt, project, lock, pm, err_event, err_results):
     """Checkout work tree for one project
@@ -455,7 +569,7 @@ later is required to fix a server side protocol bug.
       opt: Program options returned from optparse.  See _Options().
       project: Project object for the project to checkout.
       lock: Lock for accessing objects that are shared amongst multiple
-          _CheckoutWorker() threads.
+          _CheckoutProjectList() threads.
       pm: Instance of a Project object.  We will call pm.update() (with our
           lock held).
       err_event: We'll set this event in the case of an error (after printing
@@ -483,8 +597,8 @@ later is required to fix a server side protocol bug.
         # Lock around all the rest of the code, since printing, updating a set
         # and Progress.update() are not thread safe.
         lock.acquire()
-        success = syncbuf.Finish()
         did_lock = True
+        success = syncbuf.Finish()
 
         if not success:
           err_event.set()
@@ -502,10 +616,13 @@ later is required to fix a server side protocol bug.
         err_event.set()
         raise
     finally:
-      if did_lock:
-        if not success:
-          err_results.append(project.relpath)
-        lock.release()
+      if not did_lock:
+        # We bailed out (e.g. Sync_LocalHalf raised) before taking the lock, but
+        # still need to record the failure.
+        lock.acquire()
+      if not success:
+        err_results.append(project.relpath)
+      lock.release()
       finish = time.time()
       self.event_log.AddSync(project, event_log.TASK_SYNC_LOCAL,
                              start, finish, success)
@@ -531,43 +648,93 @@ later is required to fix a server side protocol bug.
     # downloaded when demanded (at checkout time), which is similar to the
     # Sync_NetworkHalf case and parallelism would be helpful.
     if self.manifest.CloneFilter:
-      syncjobs = self.jobs
+      syncjobs = self.local_jobs
     else:
       syncjobs = 1
 
     lock = _threading.Lock()
     pm = Progress('Checking out projects', len(all_projects))
 
-    threads = set()
-    sem = _threading.Semaphore(syncjobs)
-
-    for project in all_projects:
-      # Check for any errors before running any more tasks.
-      # ...we'll let existing threads finish, though.
-      if err_event.isSet() and opt.fail_fast:
-        break
-
-      sem.acquire()
-      if project.worktree:
-        kwargs = dict(opt=opt,
-                      sem=sem,
-                      project=project,
-                      lock=lock,
-                      pm=pm,
-                      err_event=err_event,
-                      err_results=err_results)
-        if syncjobs > 1:
-          t = _threading.Thread(target=self._CheckoutWorker,
-                                kwargs=kwargs)
-          # Ensure that Ctrl-C will not freeze the repo process.
-          t.daemon = True
-          threads.add(t)
-          t.start()
+    # Projects without a work tree (e.g. mirrors) have nothing to checkout.
+    all_projects = [x for x in all_projects if x.worktree]
+    kwargs = dict(opt=opt,
+                  lock=lock,
+                  pm=pm,
+                  err_event=err_event,
+                  err_results=err_results)
+
+    # Nested projects must not be checked out while their parent is still in
+    # progress, so they're only started once their parent has finished.  If
+    # the parent's checkout blew up, they're skipped entirely.
+    roots, children = _CheckoutDependencies(all_projects)
+
+    def _SkipNested(parent):
+      nested = list(children.get(parent, []))
+      with lock:
+        while nested:
+          project = nested.pop()
+          print('error: Cannot checkout %s: checkout of %s failed'
+                % (project.name, parent.name), file=sys.stderr)
+          err_results.append(project.relpath)
+          nested.extend(children.get(project, []))
+
+    if syncjobs > 1:
+      # Everything that isn't waiting on a parent is free to run as soon as a
+      # worker is available.
+      batches = {}
+      executor = concurrent.futures.ThreadPoolExecutor(max_workers=syncjobs)
+      with executor:
+        def _Submit(projects):
+          chunksize = _chunksize(len(projects), syncjobs,
+                                 limit=_CHECKOUT_BATCH_SIZE)
+          futures = set()
+          for i in range(0, len(projects), chunksize):
+            batch = projects[i:i + chunksize]
+            future = executor.submit(self._CheckoutProjectList,
+                                     projects=batch, **kwargs)
+            batches[future] = batch
+            futures.add(future)
+          return futures
+
+        pending = _Submit(roots)
+        try:
+          while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            ready = []
+            for future in done:
+              batch = batches.pop(future)
+              try:
+                broken = future.result()
+              except Exception as e:
+                # Projects report their own errors, so this is a bug in the
+                # worker itself.  Treat the whole batch as broken.
+                print('error: checkout worker failed: %s: %s'
+                      % (type(e).__name__, str(e)), file=sys.stderr)
+                err_event.set()
+                broken = batch
+              for project in batch:
+                if project in broken:
+                  _SkipNested(project)
+                else:
+                  ready.extend(children.get(project, []))
+            if ready and not (err_event.isSet() and opt.fail_fast):
+              pending |= _Submit(ready)
+        except BaseException:
+          # Ensure that Ctrl-C will not leave queued checkouts running.
+          for future in pending:
+            future.cancel()
+          raise
+    else:
+      # Walk the same tree depth first, so everything nested in a project is
+      # checked out right after it.
+      pending = list(reversed(roots))
+      while pending and not (err_event.isSet() and opt.fail_fast):
+        project = pending.pop()
+        if self._CheckoutProjectList(projects=[project], **kwargs):
+          _SkipNested(project)
         else:
-          self._CheckoutWorker(**kwargs)
-
-    for t in threads:
-      t.join()
+          pending.extend(reversed(children.get(project, [])))
 
     pm.end()
 
@@ -590,11 +757,8 @@ later is required to fix a server side protocol bug.
           project.config.SetString('gc.pruneExpire', 'never')
       gc_gitdirs[project.gitdir] = project.bare_git
 
-    if multiprocessing:
-      cpu_count = multiprocessing.cpu_count()
-    else:
-      cpu_count = 1
-    jobs = min(self.jobs, cpu_count)
+    cpu_count = _cpu_count()
+    jobs = min(self.local_jobs, cpu_count)
 
     if jobs < 2:
       for bare_git in gc_gitdirs.values():
@@ -603,32 +767,34 @@ later is required to fix a server side protocol bug.
 
     config = {'pack.threads': cpu_count // jobs if cpu_count > jobs else 1}
 
-    threads = set()
-    sem = _threading.Semaphore(jobs)
-
-    def GC(bare_git):
-      try:
-        try:
-          bare_git.gc('--auto', config=config)
-        except GitError:
-          err_event.set()
-        except Exception:
-          err_event.set()
-          raise
-      finally:
-        sem.release()
-
-    for bare_git in gc_gitdirs.values():
+    def GC(gitdir, bare_git):
+      # Don't start any more GCs once a fetch or GC has failed.
       if err_event.isSet() and opt.fail_fast:
-        break
-      sem.acquire()
-      t = _threading.Thread(target=GC, args=(bare_git,))
-      t.daemon = True
-      threads.add(t)
-      t.start()
+        return
+      try:
+        bare_git.gc('--auto', config=config)
+      except GitError:
+        err_event.set()
+      except Exception as e:
+        # Record the failure like any other rather than letting one broken
+        # repo abort the whole sync.
+        print('error: Cannot gc %s: %s: %s'
+              % (gitdir, type(e).__name__, str(e)), file=sys.stderr)
+        err_event.set()
 
-    for t in threads:
-      t.join()
+    # The executor bounds how many gc processes run at once.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+      futures = [executor.submit(GC, gitdir, bare_git)
+                 for gitdir, bare_git in gc_gitdirs.items()]
+      try:
+        for future in concurrent.futures.as_completed(futures):
+          # GC() records its own failures, so this only raises for fatal
+          # errors (e.g. sys.exit()).
+          future.result()
+      except BaseException:
+        for future in futures:
+          future.cancel()
+        raise
 
   def _ReloadManifest(self, manifest_name=None):
     if manifest_name:
@@ -649,11 +815,13 @@ later is required to fix a server side protocol bug.
     if os.path.exists(file_path):
       with open(file_path, 'r') as fd:
         old_project_paths = fd.read().split('\n')
+      # Use a set so the lookups don't go quadratic on large manifests.
+      new_project_paths_set = set(new_project_paths)
       # In reversed order, so subfolders are deleted before parent folder.
       for path in sorted(old_project_paths, reverse=True):
         if not path:
           continue
-        if path not in new_project_paths:
+        if path not in new_project_paths_set:
           # If the path has already been deleted, we don't need to do it
           gitdir = os.path.join(self.manifest.topdir, path, '.git')
           if os.path.exists(gitdir):
@@ -681,6 +849,10 @@ later is required to fix a server side protocol bug.
     return 0
 
   def _SmartSyncSetup(self, opt, smart_sync_manifest_path):
+    # Only load the XML-RPC bits when we actually talk to a manifest server.
+    import xmlrpc.client
+    from persistent_transport import PersistentTransport
+
     if not self.manifest.manifest_server:
       print('error: cannot smart sync: no manifest server defined in '
             'manifest', file=sys.stderr)
@@ -798,9 +970,10 @@ later is required to fix a server side protocol bug.
                              start, time.time(), clean)
       if not clean:
         sys.exit(1)
-      self._ReloadManifest(opt.manifest_name)
-      if opt.jobs is None:
-        self.jobs = self.manifest.default.sync_j
+      # Reload whatever we're syncing to: for smart sync that's the override
+      # manifest from the server, not the plain manifest.xml.
+      self._ReloadManifest(manifest_name)
+      self._SetJobs(opt)
 
   def ValidateOptions(self, opt, args):
     if opt.force_broken:
@@ -821,11 +994,7 @@ later is required to fix a server side protocol bug.
         self.OptionParser.error('both -u and -p must be given')
 
   def Execute(self, opt, args):
-    if opt.jobs:
-      self.jobs = opt.jobs
-    if self.jobs > 1:
-      soft_limit, _ = _rlimit_nofile()
-      self.jobs = min(self.jobs, (soft_limit - 5) // 3)
+    self._SetJobs(opt)
 
     opt.quiet = opt.output_mode is False
     opt.verbose = opt.output_mode is True
@@ -918,11 +1087,10 @@ later is required to fix a server side protocol bug.
 
     self._fetch_times = _FetchTimes(self.manifest)
     if not opt.local_only:
-      to_fetch = []
+      to_fetch = list(all_projects)
       now = time.time()
       if _ONE_DAY_S <= (now - rp.LastFetch):
         to_fetch.append(rp)
-      to_fetch.extend(all_projects)
       to_fetch.sort(key=self._fetch_times.Get, reverse=True)
 
       fetched = self._Fetch(to_fetch, opt, err_event)
@@ -935,13 +1103,18 @@ later is required to fix a server side protocol bug.
           sys.exit(1)
         return
 
-      # Iteratively fetch missing and/or nested unregistered submodules
+      # Iteratively fetch missing and/or nested unregistered submodules.
       previously_missing_set = set()
       while True:
-        self._ReloadManifest(manifest_name)
-        all_projects = self.GetProjects(args,
-                                        missing_ok=True,
-                                        submodules_ok=opt.fetch_submodules)
+        # Only fetching submodules can turn up new projects.  Otherwise the
+        # manifest is still the one we loaded above, so re-parsing it would
+        # just give us the same project list, and the only projects left to
+        # retry are the ones whose fetch failed.
+        if opt.fetch_submodules:
+          self._ReloadManifest(manifest_name)
+          all_projects = self.GetProjects(args,
+                                          missing_ok=True,
+                                          submodules_ok=opt.fetch_submodules)
         missing = []
         for project in all_projects:
           if project.gitdir not in fetched:
@@ -1008,6 +1181,47 @@ later is required to fix a server side protocol bug.
       print('repo sync has finished successfully.')
 
 
+def _CheckoutDependencies(checkouts):
+  """Work out which checkouts have to wait for which.
+
+  This only matters if the manifest contains nested projects: e.g. if foo,
+  foo/bar and foo/bar/baz are project paths, then foo needs to finish before
+  foo/bar can proceed, and foo/bar needs to finish before foo/bar/baz.
+  Projects that aren't nested inside each other don't have to wait at all.
+
+  Args:
+    checkouts: The projects to checkout.
+
+  Returns:
+    A (roots, children) tuple.  roots is the list of projects that can be
+    checked out right away.  children maps a project to the projects nested
+    directly inside it, which may start once it has finished.
+  """
+  roots = []
+  children = {}
+  # depth_stack holds the (path components, project) of the current chain of
+  # parents.
+  depth_stack = []
+  # Checkouts are iterated in hierarchical order so that the checkouts on the
+  # stack are the only possible parents.  We split on the path separator so
+  # the order is hierarchical and not just lexicographical: plain string
+  # sorting would put foo-bar between foo and foo/bar.
+  # Split each path once up front and reuse the parts for the parent checks.
+  decorated = [(tuple(x.relpath.split('/')), x) for x in checkouts]
+  decorated.sort(key=lambda t: t[0])
+  for parts, checkout in decorated:
+    while depth_stack:
+      top_parts, top = depth_stack[-1]
+      if parts[:len(top_parts)] == top_parts:
+        children.setdefault(top, []).append(checkout)
+        break
+      depth_stack.pop()
+    else:
+      roots.append(checkout)
+    depth_stack.append((parts, checkout))
+  return roots, children
+
+
 def _PostRepoUpgrade(manifest, quiet=False):
   wrapper = Wrapper()
   if wrapper.NeedSetupGnuPG():
@@ -1045,12 +1259,13 @@ def _VerifyTag(project):
     return True
 
   try:
-    cur = project.bare_git.describe(project.GetRevisionId())
+    # Resolve the revision from the refs we've already loaded rather than
+    # spawning another `git rev-parse`.
+    cur = project.bare_git.describe(project.GetRevisionId(project.bare_ref.all))
   except GitError:
     cur = None
 
-  if not cur \
-     or re.compile(r'^.*-[0-9]{1,}-g[0-9a-f]{1,}$').match(cur):
+  if not cur or _UNTAGGED_DESCRIBE_RE.match(cur):
     rev = project.revisionExpr
     if rev.startswith(R_HEADS):
       rev = rev[len(R_HEADS):]
@@ -1127,109 +1342,20 @@ class _FetchTimes(object):
     for name in to_delete:
       del self._times[name]
 
+    # Write to a temp file and rename it into place so that an interrupted
+    # sync can't leave a truncated file behind (which would throw away all
+    # the times we've collected so far).
+    tmp_path = self._path + '.tmp'
     try:
-      with open(self._path, 'w') as f:
-        json.dump(self._times, f, indent=2)
-    except (IOError, TypeError):
+      # Serialize in one go: unlike json.dump() (or any indent), json.dumps()
+      # can use the C encoder, and we only need to make a single write.
+      with open(tmp_path, 'w') as f:
+        f.write(json.dumps(self._times))
+        f.flush()
+        os.fsync(f.fileno())
+      platform_utils.rename(tmp_path, self._path)
+    except (IOError, OSError, TypeError):
       try:
-        platform_utils.remove(self._path)
+        platform_utils.remove(tmp_path)
       except OSError:
         pass
-
-# This is a replacement for xmlrpc.client.Transport using urllib2
-# and supporting persistent-http[s]. It cannot change hosts from
-# request to request like the normal transport, the real url
-# is passed during initialization.
-
-
-class PersistentTransport(xmlrpc.client.Transport):
-  def __init__(self, orig_host):
-    self.orig_host = orig_host
-
-  def request(self, host, handler, request_body, verbose=False):
-    with GetUrlCookieFile(self.orig_host, not verbose) as (cookiefile, proxy):
-      # Python doesn't understand cookies with the #HttpOnly_ prefix
-      # Since we're only using them for HTTP, copy the file temporarily,
-      # stripping those prefixes away.
-      if cookiefile:
-        tmpcookiefile = tempfile.NamedTemporaryFile(mode='w')
-        tmpcookiefile.write("# HTTP Cookie File")
-        try:
-          with open(cookiefile) as f:
-            for line in f:
-              if line.startswith("#HttpOnly_"):
-                line = line[len("#HttpOnly_"):]
-              tmpcookiefile.write(line)
-          tmpcookiefile.flush()
-
-          cookiejar = cookielib.MozillaCookieJar(tmpcookiefile.name)
-          try:
-            cookiejar.load()
-          except cookielib.LoadError:
-            cookiejar = cookielib.CookieJar()
-        finally:
-          tmpcookiefile.close()
-      else:
-        cookiejar = cookielib.CookieJar()
-
-      proxyhandler = urllib.request.ProxyHandler
-      if proxy:
-        proxyhandler = urllib.request.ProxyHandler({
-            "http": proxy,
-            "https": proxy})
-
-      opener = urllib.request.build_opener(
-          urllib.request.HTTPCookieProcessor(cookiejar),
-          proxyhandler)
-
-      url = urllib.parse.urljoin(self.orig_host, handler)
-      parse_results = urllib.parse.urlparse(url)
-
-      scheme = parse_results.scheme
-      if scheme == 'persistent-http':
-        scheme = 'http'
-      if scheme == 'persistent-https':
-        # If we're proxying through persistent-https, use http. The
-        # proxy itself will do the https.
-        if proxy:
-          scheme = 'http'
-        else:
-          scheme = 'https'
-
-      # Parse out any authentication information using the base class
-      host, extra_headers, _ = self.get_host_info(parse_results.netloc)
-
-      url = urllib.parse.urlunparse((
-          scheme,
-          host,
-          parse_results.path,
-          parse_results.params,
-          parse_results.query,
-          parse_results.fragment))
-
-      request = urllib.request.Request(url, request_body)
-      if extra_headers is not None:
-        for (name, header) in extra_headers:
-          request.add_header(name, header)
-      request.add_header('Content-Type', 'text/xml')
-      try:
-        response = opener.open(request)
-      except urllib.error.HTTPError as e:
-        if e.code == 501:
-          # We may have been redirected through a login process
-          # but our POST turned into a GET. Retry.
-          response = opener.open(request)
-        else:
-          raise
-
-      p, u = xmlrpc.client.getparser()
-      while 1:
-        data = response.read(1024)
-        if not data:
-          break
-        p.feed(data)
-      p.close()
-      return u.close()
-
-  def close(self):
-    pass
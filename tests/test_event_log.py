@@ -0,0 +1,59 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2020 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the event_log.py module."""
+
+from __future__ import print_function
+
+import unittest
+
+try:
+  from unittest import mock
+except ImportError:
+  import mock
+
+import event_log
+
+
+class EventLogTests(unittest.TestCase):
+  """Tests the EventLog class."""
+
+  def setUp(self):
+    self.log = event_log.EventLog()
+
+  def test_add(self):
+    """Events are recorded and can be finished later."""
+    event = self.log.Add('name', event_log.TASK_COMMAND, 1)
+    self.assertEqual('name', event['name'])
+    self.log.FinishEvent(event, 2, True)
+    self.assertEqual('pass', event['status'])
+    self.assertEqual([event], self.log._log)
+
+  def test_disabled(self):
+    """Nothing is recorded once the log is disabled."""
+    self.log.Disable()
+    event = self.log.Add('name', event_log.TASK_COMMAND, 1)
+    self.assertIsNone(event)
+    self.assertIsNone(self.log.FinishEvent(event, 2, True))
+    self.assertEqual([], self.log._log)
+
+  def test_disabled_sync(self):
+    """Sync events don't look up project details when disabled."""
+    self.log.Disable()
+    project = mock.MagicMock()
+    self.assertIsNone(self.log.AddSync(project, event_log.TASK_SYNC_NETWORK,
+                                       1, 2, True))
+    project.GetCommitRevisionId.assert_not_called()
@@ -18,6 +18,7 @@
 
 from __future__ import print_function
 
+import io
 import re
 import unittest
 
@@ -111,6 +112,45 @@ class UserAgentUnitTest(unittest.TestCase):
     self.assertIsNotNone(m)
 
 
+class GitCommandOutputTests(unittest.TestCase):
+  """Test GitCommand output handling."""
+
+  def test_capture(self):
+    """Captured output is returned and not shown."""
+    with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+      p = git_command.GitCommand(None, ['version'], capture_stdout=True)
+      self.assertEqual(0, p.Wait())
+    self.assertTrue(p.stdout.startswith('git version'))
+    self.assertEqual('', stdout.getvalue())
+
+  def test_tee(self):
+    """Passed through output is shown and its tail is kept."""
+    with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+      p = git_command.GitCommand(None, ['version'])
+      self.assertEqual(0, p.Wait())
+    self.assertTrue(stdout.getvalue().startswith('git version'))
+    self.assertEqual(stdout.getvalue(), p.stdout)
+
+  def _TeeWrites(self, **kwargs):
+    """Return the writes made while passing through a partial line."""
+    stdout = mock.MagicMock()
+    with mock.patch('sys.stdout', stdout):
+      p = git_command.GitCommand(
+          None, ['-c', 'alias.partial=!printf abc; sleep 0.2; printf def',
+                 'partial'], **kwargs)
+      self.assertEqual(0, p.Wait())
+    self.assertEqual('abcdef', p.stdout)
+    return [args[0] for args, _ in stdout.write.call_args_list]
+
+  def test_tee_partial_line(self):
+    """Partial lines are passed through as they arrive."""
+    self.assertEqual(['abc', 'def'], self._TeeWrites())
+
+  def test_tee_line_buffered(self):
+    """Line buffered output holds partial lines back."""
+    self.assertEqual(['abcdef'], self._TeeWrites(line_buffered=True))
+
+
 class GitRequireTests(unittest.TestCase):
   """Test the git_require helper."""
 
@@ -0,0 +1,59 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2020 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the progress.py module."""
+
+from __future__ import print_function
+
+import io
+import unittest
+
+try:
+  from unittest import mock
+except ImportError:
+  import mock
+
+import progress
+
+
+class ProgressTests(unittest.TestCase):
+  """Tests the Progress class."""
+
+  def setUp(self):
+    mock.patch.object(progress, '_NOT_TTY', False).start()
+    mock.patch.object(progress, 'IsTrace', return_value=False).start()
+
+  def tearDown(self):
+    mock.patch.stopall()
+
+  def _Run(self, total, updates, **kwargs):
+    """Run |updates| single updates and return the number of redraws."""
+    stderr = io.StringIO()
+    with mock.patch('sys.stderr', stderr):
+      pm = progress.Progress('Testing', total, **kwargs)
+      pm._show = True
+      for _ in range(updates):
+        pm.update()
+    return stderr.getvalue().count('\r')
+
+  def test_redraw_per_percent(self):
+    """Only redraw when the displayed percentage changes."""
+    self.assertEqual(self._Run(1000, 1000), 101)
+
+  def test_always_print_percentage(self):
+    """Redraw on every update when asked to."""
+    self.assertEqual(
+        self._Run(1000, 1000, always_print_percentage=True), 1000)
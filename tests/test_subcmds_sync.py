@@ -0,0 +1,279 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2020 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the subcmds/sync.py module."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+  from unittest import mock
+except ImportError:
+  import mock
+
+from subcmds import sync
+
+
+class CpuCountTests(unittest.TestCase):
+  """Check _cpu_count behavior."""
+
+  def test_affinity(self):
+    """Only count the CPUs we're allowed to run on."""
+    with mock.patch('os.sched_getaffinity', create=True, return_value={0, 3}):
+      with mock.patch('os.cpu_count', return_value=16):
+        self.assertEqual(2, sync._cpu_count())
+
+  def test_no_affinity(self):
+    """Fall back to the CPU count where affinity isn't supported."""
+    fake_os = mock.Mock(spec=['cpu_count'])
+    fake_os.cpu_count.return_value = 16
+    with mock.patch.object(sync, 'os', fake_os):
+      self.assertEqual(16, sync._cpu_count())
+
+
+class SetJobsTests(unittest.TestCase):
+  """Check Sync._SetJobs behavior."""
+
+  def setUp(self):
+    mock.patch.object(sync, '_cpu_count', return_value=2).start()
+    mock.patch.object(sync, '_rlimit_nofile',
+                      return_value=(1024, 1024)).start()
+    self.cmd = sync.Sync()
+    self.cmd.manifest = mock.MagicMock()
+    self.cmd.manifest.default.sync_j = None
+
+  def tearDown(self):
+    mock.patch.stopall()
+
+  def test_default(self):
+    """Fetches run in parallel by default, local work doesn't."""
+    self.cmd._SetJobs(mock.MagicMock(jobs=None))
+    self.assertEqual(8, self.cmd.jobs)
+    self.assertEqual(1, self.cmd.local_jobs)
+
+  def test_default_many_cpus(self):
+    """The fetch default scales with the CPUs we can use."""
+    sync._cpu_count.return_value = 16
+    self.cmd._SetJobs(mock.MagicMock(jobs=None))
+    self.assertEqual(16, self.cmd.jobs)
+
+  def test_sync_j(self):
+    """The manifest's sync-j applies to everything."""
+    self.cmd.manifest.default.sync_j = 3
+    self.cmd._SetJobs(mock.MagicMock(jobs=None))
+    self.assertEqual(3, self.cmd.jobs)
+    self.assertEqual(3, self.cmd.local_jobs)
+
+  def test_jobs(self):
+    """-j overrides sync-j."""
+    self.cmd.manifest.default.sync_j = 3
+    self.cmd._SetJobs(mock.MagicMock(jobs=5))
+    self.assertEqual(5, self.cmd.jobs)
+    self.assertEqual(5, self.cmd.local_jobs)
+
+  def test_rlimit(self):
+    """Don't run more jobs than we have file descriptors for."""
+    sync._rlimit_nofile.return_value = (20, 20)
+    self.cmd._SetJobs(mock.MagicMock(jobs=100))
+    self.assertEqual(5, self.cmd.jobs)
+    self.assertEqual(5, self.cmd.local_jobs)
+
+
+class UpdateManifestProjectTests(unittest.TestCase):
+  """Check Sync._UpdateManifestProject behavior."""
+
+  def setUp(self):
+    mock.patch.object(sync, 'SyncBuffer').start()
+    self.cmd = sync.Sync()
+    self.cmd.manifest = mock.MagicMock()
+    self.cmd.event_log = mock.MagicMock()
+    mock.patch.object(self.cmd, '_SetJobs').start()
+    self.mp = mock.MagicMock(HasChanges=True)
+
+  def tearDown(self):
+    mock.patch.stopall()
+
+  def test_smart_sync_keeps_override(self):
+    """An updated manifest project mustn't drop the smart sync manifest."""
+    opt = mock.MagicMock(local_only=True, manifest_name=None)
+    self.cmd._UpdateManifestProject(opt, self.mp, 'smart_sync_override.xml')
+    self.cmd.manifest.Override.assert_called_once_with(
+        'smart_sync_override.xml')
+    self.cmd.manifest._Unload.assert_not_called()
+
+  def test_default_manifest(self):
+    """Without an override the manifest is simply reloaded."""
+    opt = mock.MagicMock(local_only=True, manifest_name=None)
+    self.cmd._UpdateManifestProject(opt, self.mp, None)
+    self.cmd.manifest._Unload.assert_called_once_with()
+    self.cmd.manifest.Override.assert_not_called()
+
+
+class ChunksizeTests(unittest.TestCase):
+  """Check _chunksize behavior."""
+
+  def test_few_projects(self):
+    """Every worker should get some work when there is little to go around."""
+    self.assertEqual(1, sync._chunksize(1, 1))
+    self.assertEqual(1, sync._chunksize(8, 8))
+    self.assertEqual(1, sync._chunksize(3, 8))
+
+  def test_many_projects(self):
+    """Batches should grow with the project count."""
+    self.assertEqual(4, sync._chunksize(128, 8))
+    self.assertEqual(25, sync._chunksize(100, 1))
+
+  def test_capped(self):
+    """Batches should never exceed the worker batch size."""
+    self.assertEqual(sync._WORKER_BATCH_SIZE, sync._chunksize(10000, 1))
+    self.assertEqual(4, sync._chunksize(10000, 1, limit=4))
+
+
+class CheckoutDependenciesTests(unittest.TestCase):
+  """Check _CheckoutDependencies behavior."""
+
+  class _Project(object):
+    def __init__(self, relpath):
+      self.relpath = relpath
+
+  def _Deps(self, *relpaths):
+    roots, children = sync._CheckoutDependencies(
+        [self._Project(x) for x in relpaths])
+    return ([p.relpath for p in roots],
+            dict((k.relpath, [p.relpath for p in v])
+                 for k, v in children.items()))
+
+  def test_no_nested(self):
+    """Flat projects can all be checked out at once."""
+    self.assertEqual((['a', 'b', 'c'], {}), self._Deps('c', 'a', 'b'))
+
+  def test_nested(self):
+    """Nested projects wait for their closest parent."""
+    self.assertEqual(
+        (['foo', 'foo-bar'], {'foo': ['foo/bar'], 'foo/bar': ['foo/bar/baz']}),
+        self._Deps('foo/bar/baz', 'foo-bar', 'foo/bar', 'foo'))
+
+  def test_siblings(self):
+    """Children only wait for their own parent."""
+    self.assertEqual(
+        (['a', 'b'], {'a': ['a/x', 'a/y'], 'b': ['b/y']}),
+        self._Deps('b/y', 'a/y', 'a/x', 'b', 'a'))
+
+  def test_missing_parent(self):
+    """Projects whose parent isn't being checked out don't wait."""
+    self.assertEqual((['a/x', 'b'], {}), self._Deps('b', 'a/x'))
+
+  def test_empty(self):
+    """No projects means nothing to do."""
+    self.assertEqual(([], {}), sync._CheckoutDependencies([]))
+
+
+class CheckoutTests(unittest.TestCase):
+  """Check Sync._Checkout behavior."""
+
+  def setUp(self):
+    mock.patch.object(sync, 'Progress').start()
+    mock.patch.object(sync, 'SyncBuffer').start()
+    self.cmd = sync.Sync()
+    self.cmd.manifest = mock.MagicMock()
+    self.cmd.event_log = mock.MagicMock()
+    self.cmd.local_jobs = 4
+
+  def tearDown(self):
+    mock.patch.stopall()
+
+  def _Project(self, relpath, exc=None):
+    project = mock.MagicMock(relpath=relpath, worktree='/w/' + relpath)
+    project.name = relpath
+    project.Sync_LocalHalf.side_effect = exc
+    return project
+
+  def _CheckoutBroken(self):
+    """Checkout a tree where project "a" blows up."""
+    projects = [self._Project('a', RuntimeError('boom')), self._Project('a/x'),
+                self._Project('a/x/y'), self._Project('b'),
+                self._Project('b/x')]
+    err_event = mock.MagicMock()
+    err_results = []
+    with mock.patch('sys.stderr'):
+      self.cmd._Checkout(projects, mock.MagicMock(fail_fast=False), err_event,
+                         err_results)
+    err_event.set.assert_called_with()
+    self.assertEqual(['a', 'a/x', 'a/x/y'], sorted(err_results))
+    self.assertEqual([1, 0, 0, 1, 1],
+                     [p.Sync_LocalHalf.call_count for p in projects])
+
+  def test_exception_skips_children(self):
+    """A checkout that blows up only holds back its own nested projects."""
+    self._CheckoutBroken()
+
+  def test_exception_skips_children_serial(self):
+    """Checking out one project at a time skips the same projects."""
+    self.cmd.local_jobs = 1
+    self._CheckoutBroken()
+
+
+class FetchTimesTests(unittest.TestCase):
+  """Check _FetchTimes behavior."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self.manifest = mock.MagicMock(repodir=self.tempdir)
+    self.path = os.path.join(self.tempdir, '.repo_fetchtimes.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def test_save(self):
+    """Saved times are written out in full with no temp file left behind."""
+    times = sync._FetchTimes(self.manifest)
+    project = mock.MagicMock()
+    project.name = 'a'
+    times.Set(project, 10)
+    times.Save()
+    with open(self.path) as f:
+      self.assertEqual(1, len(json.load(f)))
+    self.assertEqual(['.repo_fetchtimes.json'], os.listdir(self.tempdir))
+
+  def test_save_failure_keeps_old_file(self):
+    """A failed write leaves the previous times alone."""
+    with open(self.path, 'w') as f:
+      f.write('{"a": 1.0}')
+    times = sync._FetchTimes(self.manifest)
+    times._times = {'a': object()}
+    times._seen.add('a')
+    times.Save()
+    with open(self.path) as f:
+      self.assertEqual({'a': 1.0}, json.load(f))
+    self.assertEqual(['.repo_fetchtimes.json'], os.listdir(self.tempdir))
+
+
+class UntaggedDescribeTests(unittest.TestCase):
+  """Check _UNTAGGED_DESCRIBE_RE behavior."""
+
+  def test_tagged(self):
+    """Exact tags should not match."""
+    self.assertIsNone(sync._UNTAGGED_DESCRIBE_RE.match('v2.8'))
+    self.assertIsNone(sync._UNTAGGED_DESCRIBE_RE.match('v1.13-rc1'))
+
+  def test_untagged(self):
+    """Commits past a tag should match."""
+    self.assertIsNotNone(sync._UNTAGGED_DESCRIBE_RE.match('v2.8-3-gdeadbeef'))
+    self.assertIsNotNone(
+        sync._UNTAGGED_DESCRIBE_RE.match('v1.13-rc1-12-g0123abc'))